@@ -5,13 +5,23 @@ RAG System for PDF Question Answering with Citations
 Strict grounding - answers only from retrieved context, no hallucinations
 """
 
+import io
 import os
 import sys
 import re
 import json
+import sqlite3
+import hashlib
 import argparse
-from typing import List, Dict, Tuple, Optional
-from dataclasses import dataclass
+import threading
+import weakref
+import contextlib
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from typing import Callable, Iterable, List, Dict, Tuple, Optional, Union
+from dataclasses import dataclass, field
 
 # Fix Windows console encoding
 if sys.platform == 'win32':
@@ -21,92 +31,163 @@ if sys.platform == 'win32':
 
 import numpy as np
 import faiss
+import torch
 from pypdf import PdfReader
 from sentence_transformers import SentenceTransformer
 
+# Retrieval scores (cosine) below this mean the document doesn't cover the question
+RELEVANCE_THRESHOLD = 0.4
 
-@dataclass
+try:
+    import bm25s
+except ImportError:  # Hybrid retrieval is optional; dense search still works
+    bm25s = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # Fall back to pure-Python pypdf extraction
+    pdfium = None
+
+try:
+    from numba import njit, prange
+except ImportError:  # Exact scoring falls back to NumPy
+    njit = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+@contextlib.contextmanager
+def _file_lock(path: str):
+    """Hold an exclusive lock on path + '.lock' (no-op where fcntl is unavailable)"""
+    if fcntl is None:
+        yield
+        return
+    with open(path + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _open_pdf(pdf_data: bytes) -> Tuple[object, int]:
+    """Open PDF bytes with PDFium (C++) when installed, else pypdf; returns (doc, page count)"""
+    if pdfium is not None:
+        doc = pdfium.PdfDocument(pdf_data)
+        return doc, len(doc)
+    reader = PdfReader(io.BytesIO(pdf_data))
+    return reader, len(reader.pages)
+
+
+def _extract_pages(doc, start: int, stop: int) -> List[Tuple[int, Optional[str]]]:
+    """Extract raw text for pages [start, stop) as (page_num, text or None)"""
+    pages = []
+    for i in range(start, stop):
+        try:
+            if pdfium is not None:
+                page = doc[i]
+                textpage = page.get_textpage()
+                text = textpage.get_text_range()
+                textpage.close()
+                page.close()
+            else:
+                text = doc.pages[i].extract_text()
+            pages.append((i + 1, text))
+        except Exception as e:
+            print(f"Warning: Failed to extract text from page {i + 1}: {e}")
+            pages.append((i + 1, None))
+    return pages
+
+
+def _extract_page_range(pdf_data: bytes, start: int, stop: int) -> List[Tuple[int, Optional[str]]]:
+    """Worker entry point: each process opens its own document"""
+    doc, _ = _open_pdf(pdf_data)
+    return _extract_pages(doc, start, stop)
+
+
+@dataclass(frozen=True)
 class Chunk:
     """Represents a text chunk with metadata"""
     text: str
     page_num: int
     chunk_id: int
+    citation: str = field(init=False, repr=False, compare=False)  # [p{page}:c{chunk}]
     
-    def get_citation(self) -> str:
-        """Return citation format [p{page}:c{chunk}]"""
-        return f"[p{self.page_num}:c{self.chunk_id}]"
+    def __post_init__(self):
+        object.__setattr__(self, 'citation', f"[p{self.page_num}:c{self.chunk_id}]")
 
 
 class PDFProcessor:
     """Extracts and chunks text from PDF"""
     
+    PAGES_PER_WORKER = 16  # Minimum pages per process before parallelizing
+    
+    # Watermarks ("STRICTLY CONFIDENTIAL", single or repeated) and navigation UI elements
+    _JUNK_RE = re.compile(
+        r'STRICTLY\s+CONFIDENTIAL(?:\s*STRICTLY\s+CONFIDENTIAL)*'
+        r'|Home\s+outline\s+'
+        r'|Hamburger\s+Menu\s+Icon\s+with\s+solid\s+fill\s*',
+        re.IGNORECASE
+    )
+    _WHITESPACE_RE = re.compile(r'\s+')
+    
     def __init__(self, chunk_size: int = 500, chunk_overlap: int = 100):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
     
     def clean_text(self, text: str) -> str:
         """Clean up repetitive headers, footers, and watermarks"""
-        # Remove "STRICTLY CONFIDENTIAL" patterns (single or repeated)
-        text = re.sub(r'STRICTLY\s+CONFIDENTIAL(\s*STRICTLY\s+CONFIDENTIAL)*', '', text, flags=re.IGNORECASE)
-        
-        # Remove navigation UI elements
-        text = re.sub(r'Home\s+outline\s+', '', text, flags=re.IGNORECASE)
-        text = re.sub(r'Hamburger\s+Menu\s+Icon\s+with\s+solid\s+fill\s*', '', text, flags=re.IGNORECASE)
-        
-        # Clean up extra whitespace
-        text = re.sub(r'\s+', ' ', text)
+        return self._WHITESPACE_RE.sub(' ', self._JUNK_RE.sub('', text)).strip()
+    
+    def extract_text_by_page(self, pdf: Union[str, bytes]) -> List[Tuple[int, str]]:
+        """Extract text from a PDF path or raw PDF bytes, returns list of (page_num, text)"""
+        if isinstance(pdf, str):
+            with open(pdf, 'rb') as f:
+                pdf = f.read()
+        doc, n_pages = _open_pdf(pdf)
         
-        return text.strip()
+        # Page extraction is CPU-bound; fan large PDFs out across processes. Only with
+        # fork: spawn/forkserver workers re-import __main__ (and with it torch, faiss, ...)
+        workers = min(os.cpu_count() or 1, n_pages // self.PAGES_PER_WORKER)
+        if multiprocessing.get_start_method() != "fork":
+            workers = 1
+        if workers <= 1:
+            raw_pages = _extract_pages(doc, 0, n_pages)
+        else:
+            bounds = [n_pages * w // workers for w in range(workers + 1)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                parts = executor.map(_extract_page_range, repeat(pdf), bounds[:-1], bounds[1:])
+                raw_pages = [page for part in parts for page in part]
         
-        return text.strip()
-    
-    def extract_text_by_page(self, pdf_path: str) -> List[Tuple[int, str]]:
-        """Extract text from PDF, returns list of (page_num, text)"""
-        reader = PdfReader(pdf_path)
         pages = []
-        for i, page in enumerate(reader.pages, start=1):
-            try:
-                text = page.extract_text()
-                if text.strip():
-                    # Clean the text before adding
-                    cleaned_text = self.clean_text(text)
-                    if cleaned_text:
-                        pages.append((i, cleaned_text))
-            except Exception as e:
-                print(f"Warning: Failed to extract text from page {i}: {e}")
-                continue
+        for page_num, text in raw_pages:
+            if text and text.strip():
+                # Clean the text before adding
+                cleaned_text = self.clean_text(text)
+                if cleaned_text:
+                    pages.append((page_num, cleaned_text))
         return pages
     
     def chunk_text(self, text: str, page_num: int, start_chunk_id: int) -> List[Chunk]:
         """Split text into overlapping chunks"""
-        chunks = []
         words = text.split()
+        step = max(self.chunk_size - self.chunk_overlap, 1)
         
-        if not words:
-            return chunks
-        
-        chunk_id = start_chunk_id
-        start = 0
-        
-        while start < len(words):
-            end = start + self.chunk_size
-            chunk_words = words[start:end]
-            chunk_text = ' '.join(chunk_words)
-            
-            chunks.append(Chunk(
-                text=chunk_text,
+        return [
+            Chunk(
+                text=' '.join(words[start:start + self.chunk_size]),
                 page_num=page_num,
-                chunk_id=chunk_id
-            ))
-            
-            chunk_id += 1
-            start += self.chunk_size - self.chunk_overlap
-        
-        return chunks
+                chunk_id=start_chunk_id + i
+            )
+            for i, start in enumerate(range(0, len(words), step))
+        ]
     
-    def process_pdf(self, pdf_path: str) -> List[Chunk]:
-        """Extract and chunk entire PDF"""
-        pages = self.extract_text_by_page(pdf_path)
+    def process_pdf(self, pdf: Union[str, bytes]) -> List[Chunk]:
+        """Extract and chunk entire PDF (path or raw bytes)"""
+        pages = self.extract_text_by_page(pdf)
         all_chunks = []
         chunk_counter = 0
         
@@ -118,56 +199,592 @@ class PDFProcessor:
         return all_chunks
 
 
+class OnnxEncoder:
+    """int8-quantized ONNX Runtime encoder exposing the SentenceTransformer encode() subset we use"""
+    
+    CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "rag_onnx")
+    MAX_SEQ_LENGTH = 256  # Same truncation as the sentence-transformers MiniLM config
+    
+    def __init__(self, model_name: str):
+        """Export + quantize the model on first use, then load it from ~/.cache"""
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+        
+        model_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        save_dir = os.path.join(self.CACHE_DIR, model_id.replace("/", "--") + "-int8")
+        model_path = os.path.join(save_dir, "model_quantized.onnx")
+        
+        if not os.path.exists(model_path):
+            from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+            
+            print(f"🔧 Exporting {model_id} to int8 ONNX (first run only)...")
+            model = ORTModelForFeatureExtraction.from_pretrained(
+                model_id, export=True, provider="CPUExecutionProvider")
+            ORTQuantizer.from_pretrained(model).quantize(
+                save_dir=save_dir,
+                quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            )
+            AutoTokenizer.from_pretrained(model_id).save_pretrained(save_dir)
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(save_dir)
+        self.session = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+    
+    def encode(self, sentences: List[str], batch_size: int = 32, show_progress_bar: bool = False,
+               convert_to_numpy: bool = True, normalize_embeddings: bool = False) -> np.ndarray:
+        """Tokenize -> run session -> mean-pool -> (optionally) L2-normalize"""
+        # Length-sort so each padded batch wastes as few tokens as possible
+        order = np.argsort([-len(s) for s in sentences], kind="stable")
+        embeddings = [None] * len(sentences)
+        
+        for start in range(0, len(sentences), batch_size):
+            batch_idx = order[start:start + batch_size]
+            inputs = self.tokenizer(
+                [sentences[i] for i in batch_idx], padding=True, truncation=True,
+                max_length=self.MAX_SEQ_LENGTH, return_tensors="np"
+            )
+            feeds = {k: v.astype(np.int64) for k, v in inputs.items() if k in self.input_names}
+            token_embeddings = self.session.run(None, feeds)[0]
+            
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            
+            for i, vector in zip(batch_idx, pooled):
+                embeddings[i] = vector
+        
+        return np.stack(embeddings).astype(np.float32)
+
+
+def _quantize_int8(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization: returns (int8 rows, float32 per-row scales)"""
+    scales = np.abs(matrix).max(axis=1).astype(np.float32) / 127.0
+    scales[scales == 0] = 1.0
+    return np.round(matrix / scales[:, None]).astype(np.int8), scales
+
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _topk_cosine(mat_q8, row_scale, q_q8, q_scale, k, out_idx, out_score):
+        """Fused int8 dot product + top-k over the rows of mat_q8.
+        
+        Score of row i is (mat_q8[i] . q_q8) * row_scale[i] * q_scale, with the
+        dot product accumulated in integers. Each block of rows keeps its own
+        sorted top-k, merged at the end, so the matrix is streamed exactly
+        once without a full score vector.
+        """
+        n, d = mat_q8.shape
+        n_blocks = min(n, 64)
+        block_idx = np.full((n_blocks, k), -1, np.int64)
+        block_score = np.full((n_blocks, k), -np.inf, np.float32)
+        
+        for b in prange(n_blocks):
+            for i in range(b * n // n_blocks, (b + 1) * n // n_blocks):
+                acc = 0
+                for j in range(d):
+                    acc += np.int32(mat_q8[i, j]) * np.int32(q_q8[j])
+                s = np.float32(acc) * row_scale[i] * q_scale
+                if s > block_score[b, k - 1]:
+                    pos = k - 1
+                    while pos > 0 and block_score[b, pos - 1] < s:
+                        block_score[b, pos] = block_score[b, pos - 1]
+                        block_idx[b, pos] = block_idx[b, pos - 1]
+                        pos -= 1
+                    block_score[b, pos] = s
+                    block_idx[b, pos] = i
+        
+        out_idx[:] = -1
+        out_score[:] = -np.inf
+        for b in range(n_blocks):
+            for t in range(k):
+                s = block_score[b, t]
+                if block_idx[b, t] < 0 or s <= out_score[k - 1]:
+                    break
+                pos = k - 1
+                while pos > 0 and out_score[pos - 1] < s:
+                    out_score[pos] = out_score[pos - 1]
+                    out_idx[pos] = out_idx[pos - 1]
+                    pos -= 1
+                out_score[pos] = s
+                out_idx[pos] = block_idx[b, t]
+else:
+    _topk_cosine = None
+
+
+def _warm_topk_kernel():
+    """Compile (or load the cached build of) the top-k kernel so the first query isn't charged for it"""
+    if _topk_cosine is None:
+        return
+    mat = np.zeros((2, 4), np.int8)
+    readonly_mat = mat.copy()
+    readonly_mat.setflags(write=False)
+    # Freshly built matrices are writable; ones loaded from the cache are read-only memmaps,
+    # which Numba compiles as a separate signature
+    for chunk_matrix in (mat, readonly_mat):
+        _topk_cosine(chunk_matrix, np.ones(2, np.float32), np.zeros(4, np.int8),
+                     np.float32(1.0), 1, np.empty(1, np.int64), np.empty(1, np.float32))
+
+
+# Loaded encoders, shared by every VectorStore in the process: (model_name, device) -> (model, backend)
+_MODEL_CACHE: Dict[Tuple[str, str], Tuple[object, str]] = {}
+
+
+def _best_device() -> str:
+    """Pick the fastest available torch device"""
+    if torch.cuda.is_available():
+        return "cuda"
+    if getattr(torch.backends, "mps", None) and torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def _load_encoder(model_name: str, device: str) -> Tuple[object, str]:
+    """Load (once per process) the embedding model; returns (model, backend name)"""
+    key = (model_name, device)
+    if key in _MODEL_CACHE:
+        return _MODEL_CACHE[key]
+    
+    encoder = None
+    if device == "cpu" and os.getenv("RAG_ONNX", "1") != "0":
+        try:
+            encoder = (OnnxEncoder(model_name), "onnx-int8")
+        except ImportError:
+            pass
+        except Exception as e:
+            print(f"⚠️  Warning: Could not load ONNX encoder, using PyTorch: {e}")
+    
+    if encoder is None:
+        model = SentenceTransformer(model_name, device=device)
+        if device == "cuda":
+            # MiniLM is compute-bound on GPU; fp16 roughly doubles throughput
+            model = model.half()
+        encoder = (model, "torch")
+    
+    _MODEL_CACHE[key] = encoder
+    return encoder
+
+
 class VectorStore:
     """FAISS-based vector store for semantic search"""
     
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+    ENCODE_BATCH_SIZE = 128          # Chunks per forward pass when indexing
+    HNSW_MIN_CHUNKS = 500            # Below this, exact search is faster than HNSW
+    HNSW_M = 32
+    HNSW_EF_CONSTRUCTION = 80
+    HNSW_EF_SEARCH = 64
+    LEXICAL_CANDIDATES = 4           # Candidates per result fetched from each retriever
+    RRF_K = 60                       # Reciprocal-rank fusion damping constant
+    CALIBRATION_SAMPLE = 512         # Chunks sampled to estimate pairwise similarity
+    QUERY_CACHE_SIZE = 1024          # Max query embeddings kept in memory
+    RESULT_CACHE_SIZE = 256          # Max past queries whose search results are kept
+    SEMANTIC_CACHE_THRESHOLD = 0.95  # Cosine above which a past query's results are reused
+    
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2",
+                 query_cache_path: Optional[str] = None):
         """Initialize with a sentence transformer model"""
-        self.model = SentenceTransformer(model_name)
-        self.index = None
+        self.model_name = model_name
+        self.device = _best_device()
+        self.model, self.backend = _load_encoder(model_name, self.device)
+        _warm_topk_kernel()
+        self.index = None  # HNSW graph, only built for HNSW_MIN_CHUNKS or more chunks
+        self.bm25 = None
         self.chunks = []
         self.dimension = None
+        # Chunk matrix for exact scoring, as int8 SoA: rows, per-row scale, dequantized norm
+        self.emb_q8 = None
+        self.emb_scales = None
+        self.emb_norms = None
+        self._row_scale = None  # emb_scales / emb_norms, folded once
+        self.reject_threshold = RELEVANCE_THRESHOLD
+        
+        # Exact query cache: query string -> normalized embedding (LRU)
+        self._qvec_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.query_cache_path = query_cache_path
+        self._load_query_cache()
+        if self.query_cache_path:
+            # Saved when the store is collected or at exit, without keeping it alive
+            weakref.finalize(self, self._write_query_cache, self.query_cache_path,
+                             self.embedder_id, self._qvec_cache, self.QUERY_CACHE_SIZE)
+        
+        # Semantic result cache (FIFO): past query embeddings -> (top_k, (query terms, dense_keep), results)
+        self._result_index = None
+        self._result_cache: List[Tuple[int, Tuple, List[Tuple[Chunk, float]]]] = []
+    
+    @property
+    def embedder_id(self) -> str:
+        """Identifies the embedding model + backend (vectors differ between backends)"""
+        return f"{self.model_name}:{self.backend}"
     
     def build_index(self, chunks: List[Chunk]):
         """Build FAISS index from chunks"""
         self.chunks = chunks
         
-        # Generate embeddings
+        # Generate normalized embeddings (sentence-transformers already
+        # length-sorts each batch to minimize padding)
         texts = [chunk.text for chunk in chunks]
-        embeddings = self.model.encode(texts, show_progress_bar=True)
+        embeddings = self.model.encode(
+            texts,
+            batch_size=self.ENCODE_BATCH_SIZE,
+            show_progress_bar=True,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        ).astype('float32')
         
-        # Build FAISS index
+        # Small corpora are scanned exactly over the int8 matrix (dense_topk);
+        # large ones get an HNSW graph (inner product == cosine on normalized vectors)
         self.dimension = embeddings.shape[1]
-        self.index = faiss.IndexFlatIP(self.dimension)  # Inner product for cosine similarity
+        if len(chunks) < self.HNSW_MIN_CHUNKS:
+            self.index = None
+        else:
+            self.index = faiss.IndexHNSWSQ(
+                self.dimension, faiss.ScalarQuantizer.QT_8bit, self.HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            self.index.hnsw.efConstruction = self.HNSW_EF_CONSTRUCTION
+            self.index.hnsw.efSearch = self.HNSW_EF_SEARCH
+            self.index.train(embeddings)
+            self.index.add(embeddings)
+        
+        self._set_quantized_embeddings(*_quantize_int8(embeddings))
+        self._calibrate_reject_threshold()
+        self._build_lexical_index()
         
-        # Normalize embeddings for cosine similarity
-        faiss.normalize_L2(embeddings)
-        self.index.add(embeddings.astype('float32'))
+        # Cached results refer to the previous index
+        self._reset_result_cache()
     
-    def search(self, query: str, top_k: int = 5) -> List[Tuple[Chunk, float]]:
-        """Search for most relevant chunks"""
+    def save(self, path: str):
+        """Write the HNSW index if any (.faiss), int8 embeddings (.q8.npy + .rows.npz) and chunk metadata (.meta.json)"""
+        if self.index is not None:
+            faiss.write_index(self.index, path + ".faiss")
+        np.save(path + ".q8.npy", np.ascontiguousarray(self.emb_q8))
+        np.savez(path + ".rows.npz", scales=self.emb_scales, norms=self.emb_norms)
+        with open(path + ".meta.json", "w", encoding="utf-8") as f:
+            json.dump([[c.text, c.page_num, c.chunk_id] for c in self.chunks], f, ensure_ascii=False)
+    
+    def load(self, path: str) -> bool:
+        """Load an index saved with save(); returns False if none is usable"""
+        if not all(os.path.exists(path + ext) for ext in (".q8.npy", ".rows.npz", ".meta.json")):
+            return False
+        try:
+            index = faiss.read_index(path + ".faiss") if os.path.exists(path + ".faiss") else None
+            # Memory-mapped: pages are read lazily, so loading is O(ms)
+            emb_q8 = np.load(path + ".q8.npy", mmap_mode="r")
+            with np.load(path + ".rows.npz") as rows:
+                scales, norms = rows["scales"], rows["norms"]
+            with open(path + ".meta.json", encoding="utf-8") as f:
+                chunks = [Chunk(text, page_num, chunk_id) for text, page_num, chunk_id in json.load(f)]
+        except Exception as e:
+            print(f"Warning: Ignoring unreadable index cache {path}: {e}")
+            return False
+        wants_index = len(chunks) >= self.HNSW_MIN_CHUNKS
+        if (not (len(emb_q8) == len(scales) == len(chunks)) or (index is not None) != wants_index
+                or (index is not None and index.ntotal != len(chunks))):
+            print(f"Warning: Ignoring inconsistent index cache {path}")
+            return False
+        
+        self.index = index
+        self.chunks = chunks
+        self.dimension = emb_q8.shape[1]
+        self._set_quantized_embeddings(emb_q8, scales, norms)
+        self._calibrate_reject_threshold()
+        self._build_lexical_index()
+        self._reset_result_cache()
+        return True
+    
+    def _set_quantized_embeddings(self, emb_q8: np.ndarray, scales: np.ndarray,
+                                  norms: Optional[np.ndarray] = None):
+        """Install the int8 chunk matrix, computing dequantized row norms if not given"""
+        if norms is None:
+            norms = np.linalg.norm(emb_q8.astype(np.float32), axis=1) * scales
+            norms[norms == 0] = 1.0
+        self.emb_q8 = emb_q8
+        self.emb_scales = scales.astype(np.float32)
+        self.emb_norms = norms.astype(np.float32)
+        self._row_scale = self.emb_scales / self.emb_norms
+    
+    def _row_vectors(self, ids) -> np.ndarray:
+        """Dequantized, unit-length chunk vectors for the given row ids"""
+        return self.emb_q8[ids].astype(np.float32) * self._row_scale[ids, None]
+    
+    def _calibrate_reject_threshold(self):
+        """Derive the off-topic cutoff from the corpus' own similarity distribution.
+        
+        A query must be closer to its best chunk than chunks typically are to
+        each other (mean - std of pairwise cosine distance). The cutoff is capped
+        at RELEVANCE_THRESHOLD so it never rejects a question that would be answered.
+        """
+        n = len(self.emb_q8)
+        if n < 2:
+            self.reject_threshold = RELEVANCE_THRESHOLD
+            return
+        sample_ids = np.linspace(0, n - 1, min(n, self.CALIBRATION_SAMPLE)).astype(int)
+        sample = self._row_vectors(sample_ids)
+        distances = 1.0 - sample @ sample.T
+        pairwise = distances[np.triu_indices_from(distances, 1)]
+        mu, sigma = float(pairwise.mean()), float(pairwise.std())
+        self.reject_threshold = min(1.0 - (mu - sigma), RELEVANCE_THRESHOLD)
+    
+    @staticmethod
+    def _quantize_query(query_embedding: np.ndarray) -> Tuple[np.ndarray, np.float32]:
+        """int8 query row plus one factor folding its scale and norm"""
+        q_q8, q_scales = _quantize_int8(query_embedding[:1])
+        q_q8 = q_q8[0]
+        q_norm = float(np.linalg.norm(q_q8.astype(np.float32))) * float(q_scales[0]) or 1.0
+        return q_q8, np.float32(q_scales[0] / q_norm)
+    
+    def _score_rows(self, ids, query_embedding: np.ndarray) -> np.ndarray:
+        """Cosine of the given rows to the query, computed exactly as dense_topk does"""
+        q_q8, q_factor = self._quantize_query(query_embedding)
+        raw = self.emb_q8[ids].astype(np.int32) @ q_q8.astype(np.int32)
+        return raw.astype(np.float32) * self._row_scale[ids] * q_factor
+    
+    def dense_search(self, query_embedding: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k dense candidates: (indices, scores), best first.
+        
+        Small corpora are scanned exactly; large ones walk the HNSW graph and
+        rescore its hits against the int8 matrix, so scores always come from
+        the same source.
+        """
         if self.index is None:
+            return self.dense_topk(query_embedding, k)
+        _, indices = self.index.search(query_embedding, k)
+        indices = indices[0][indices[0] >= 0]  # FAISS pads missing results with id -1
+        scores = self._score_rows(indices, query_embedding)
+        order = np.argsort(-scores, kind="stable")
+        return indices[order], scores[order]
+    
+    def dense_topk(self, query_embedding: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact top-k chunks by cosine over the int8 matrix: (indices, scores), best first"""
+        if self.emb_q8 is None or len(self.emb_q8) == 0:
+            return np.empty(0, np.int64), np.empty(0, np.float32)
+        k = min(k, len(self.emb_q8))
+        
+        # Quantize the query the same way as the rows
+        q_q8, q_factor = self._quantize_query(query_embedding)
+        
+        if _topk_cosine is not None:
+            indices = np.empty(k, np.int64)
+            scores = np.empty(k, np.float32)
+            _topk_cosine(np.asarray(self.emb_q8), self._row_scale, q_q8, q_factor, k, indices, scores)
+            return indices, scores
+        
+        # NumPy has no int8 GEMV: rows are widened to int32 per query in this path
+        raw = self.emb_q8 @ q_q8.astype(np.int32)
+        sims = raw.astype(np.float32) * self._row_scale * q_factor
+        indices = np.argpartition(-sims, k - 1)[:k]
+        indices = indices[np.argsort(-sims[indices])]
+        return indices, sims[indices]
+    
+    def _build_lexical_index(self):
+        """Build the BM25 index used for hybrid retrieval (if bm25s is installed)"""
+        if bm25s is None or not self.chunks:
+            self.bm25 = None
+            return
+        tokens = bm25s.tokenize([chunk.text for chunk in self.chunks],
+                                stopwords="en", show_progress=False)
+        self.bm25 = bm25s.BM25()
+        self.bm25.index(tokens, show_progress=False)
+    
+    def encode_query(self, query: str) -> np.ndarray:
+        """Return the normalized (1, d) embedding for a query, reusing cached vectors"""
+        return self.encode_queries([query])
+    
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Return normalized (N, d) embeddings; cache misses are encoded in one forward pass"""
+        missing = list(dict.fromkeys(q for q in queries if q not in self._qvec_cache))
+        if missing:
+            embeddings = self.model.encode(
+                missing, batch_size=len(missing), convert_to_numpy=True, normalize_embeddings=True
+            ).astype('float32')
+            for query, embedding in zip(missing, embeddings):
+                self._qvec_cache[query] = embedding[None, :]
+        
+        vectors = []
+        for query in queries:
+            self._qvec_cache.move_to_end(query)
+            vectors.append(self._qvec_cache[query])
+        while len(self._qvec_cache) > self.QUERY_CACHE_SIZE:
+            self._qvec_cache.popitem(last=False)
+        return np.concatenate(vectors)
+    
+    def candidate_count(self, top_k: int) -> int:
+        """Dense candidates search() uses for top_k results (extra when fusing with BM25)"""
+        return top_k * self.LEXICAL_CANDIDATES if self.bm25 is not None else top_k
+    
+    def search(self, query: str, top_k: int = 5, query_embedding: Optional[np.ndarray] = None,
+               dense: Optional[List[Tuple[int, float]]] = None,
+               dense_keep: Optional[int] = None) -> List[Tuple[Chunk, float]]:
+        """Search for most relevant chunks.
+        
+        Pass query_embedding if already encoded, and dense (the
+        candidate_count(top_k) best (index, score) pairs from dense_search)
+        if already retrieved. If dense_keep is given, only the first
+        dense_keep dense candidates may be returned on dense merit alone;
+        BM25 hits are always eligible.
+        """
+        if self.emb_q8 is None:
             return []
         
-        # Encode and normalize query
-        query_embedding = self.model.encode([query])
-        faiss.normalize_L2(query_embedding)
+        # Encode (or fetch) normalized query
+        if query_embedding is None:
+            query_embedding = self.encode_query(query)
         
-        # Search
-        scores, indices = self.index.search(query_embedding.astype('float32'), top_k)
+        # Lexical terms decide BM25 hits, so a cached result only counts if they match too
+        query_tokens = None
+        if self.bm25 is not None:
+            query_tokens = bm25s.tokenize(query, stopwords="en", return_ids=False, show_progress=False)
+        terms = tuple(sorted(query_tokens[0])) if query_tokens else ()
+        key = (terms, dense_keep)
         
-        results = []
-        for idx, score in zip(indices[0], scores[0]):
-            if idx < len(self.chunks):
-                results.append((self.chunks[idx], float(score)))
+        # Reuse results of a near-identical earlier query
+        cached = self._lookup_results(query_embedding, top_k, key)
+        if cached is not None:
+            return cached
         
+        # Dense search (fetch extra candidates when fusing with BM25)
+        n_candidates = self.candidate_count(top_k)
+        if dense is None:
+            indices, scores = self.dense_search(query_embedding, n_candidates)
+            dense = list(zip(indices.tolist(), scores.tolist()))
+        if dense_keep is None:
+            dense_keep = len(dense)
+        if self.bm25 is not None:
+            dense = self._fuse_lexical(query_tokens, query_embedding, dense, dense_keep,
+                                       n_candidates, top_k)
+        else:
+            dense = dense[:min(dense_keep, top_k)]
+        
+        results = [(self.chunks[idx], score) for idx, score in dense]
+        
+        self._store_results(query_embedding, top_k, key, results)
         return results
+    
+    def _fuse_lexical(self, query_tokens: List[List[str]], query_embedding: np.ndarray,
+                      dense: List[Tuple[int, float]], dense_keep: int, n_candidates: int,
+                      top_k: int) -> List[Tuple[int, float]]:
+        """Combine dense and BM25 rankings with reciprocal-rank fusion.
+        
+        Fusion picks which top_k chunks are returned, from BM25 hits and the
+        first dense_keep dense candidates (all candidates still count towards
+        the fused ranks). They are then ordered by cosine score (like
+        dense-only results), so the first result is the best match and
+        relevance thresholds downstream still apply.
+        """
+        lex_ids, lex_scores = self.bm25.retrieve(
+            query_tokens, k=min(n_candidates, len(self.chunks)), show_progress=False)
+        
+        fused: Dict[int, float] = {}
+        cosine: Dict[int, float] = {}
+        eligible = {idx for idx, _ in dense[:dense_keep]}
+        for rank, (idx, score) in enumerate(dense):
+            fused[idx] = 1.0 / (self.RRF_K + rank + 1)
+            cosine[idx] = score
+        for rank, (idx, score) in enumerate(zip(lex_ids[0], lex_scores[0])):
+            if score <= 0:
+                break
+            idx = int(idx)
+            eligible.add(idx)
+            fused[idx] = fused.get(idx, 0.0) + 1.0 / (self.RRF_K + rank + 1)
+            if idx not in cosine:
+                # Lexical-only hit: score it against its embedding
+                cosine[idx] = float(self._score_rows([idx], query_embedding)[0])
+        
+        selected = sorted(eligible, key=fused.get, reverse=True)[:top_k]
+        return sorted(((idx, cosine[idx]) for idx in selected), key=lambda r: r[1], reverse=True)
+    
+    def _reset_result_cache(self):
+        """Drop all cached search results"""
+        self._result_index = None
+        self._result_cache = []
+    
+    def _lookup_results(self, query_embedding: np.ndarray, top_k: int,
+                        key: Tuple) -> Optional[List[Tuple[Chunk, float]]]:
+        """Return cached results if a past query is within the semantic threshold and
+        has the same key: lexical terms ("Q1" vs "Q2" embed almost identically) and dense_keep"""
+        if self._result_index is None or self._result_index.ntotal == 0:
+            return None
+        
+        scores, indices = self._result_index.search(query_embedding, 1)
+        if scores[0][0] < self.SEMANTIC_CACHE_THRESHOLD:
+            return None
+        
+        cached_k, cached_key, results = self._result_cache[indices[0][0]]
+        if cached_k < top_k or cached_key != key:
+            return None
+        return results[:top_k]
+    
+    def _store_results(self, query_embedding: np.ndarray, top_k: int,
+                       key: Tuple, results: List[Tuple[Chunk, float]]):
+        """Remember search results for semantic cache lookups, evicting the oldest when full"""
+        if self._result_index is None:
+            self._result_index = faiss.IndexFlatIP(query_embedding.shape[1])
+        if self._result_index.ntotal >= self.RESULT_CACHE_SIZE:
+            # Flat-index removal compacts ids, keeping them aligned with the list
+            self._result_index.remove_ids(np.array([0], dtype=np.int64))
+            self._result_cache.pop(0)
+        self._result_index.add(query_embedding)
+        self._result_cache.append((top_k, key, results))
+    
+    def _load_query_cache(self):
+        """Load persisted query embeddings for this model, if any"""
+        if self.query_cache_path:
+            self._qvec_cache.update(self._read_query_cache(self.query_cache_path, self.embedder_id))
+    
+    def save_query_cache(self):
+        """Persist query embeddings so later runs skip re-encoding"""
+        if self.query_cache_path:
+            self._write_query_cache(self.query_cache_path, self.embedder_id,
+                                    self._qvec_cache, self.QUERY_CACHE_SIZE)
+    
+    @staticmethod
+    def _read_query_cache(path: str, embedder_id: str) -> "OrderedDict[str, np.ndarray]":
+        """Query embeddings saved at path by the same embedder (empty if none)"""
+        cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        if not os.path.exists(path):
+            return cache
+        try:
+            with np.load(path) as data:
+                if str(data['model']) == embedder_id:
+                    for query, vector in zip(data['queries'], data['vectors']):
+                        cache[str(query)] = vector[None, :].astype('float32')
+        except Exception as e:
+            print(f"Warning: Ignoring unreadable query cache {path}: {e}")
+        return cache
+    
+    @staticmethod
+    def _write_query_cache(path: str, embedder_id: str,
+                           cache: "OrderedDict[str, np.ndarray]", max_size: int):
+        """Merge cache into the file at path, newest entries winning"""
+        if not cache:
+            return
+        try:
+            with _file_lock(path):
+                # Other stores may have saved since this one loaded; keep their entries too
+                merged = VectorStore._read_query_cache(path, embedder_id)
+                for query, vector in cache.items():
+                    merged.pop(query, None)
+                    merged[query] = vector
+                while len(merged) > max_size:
+                    merged.popitem(last=False)
+                np.savez(
+                    path,
+                    model=np.array(embedder_id),
+                    queries=np.array(list(merged.keys())),
+                    vectors=np.concatenate(list(merged.values()))
+                )
+        except OSError as e:
+            print(f"Warning: Could not save query cache: {e}")
 
 
 class LLMInterface:
     """Interface for LLM - supports OpenAI, Gemini, and fallback"""
     
-    def __init__(self, api_key: Optional[str] = None, gemini_key: Optional[str] = None):
+    MAX_CONTEXT_WORDS = 350     # Words kept per chunk in the prompt
+    DUPLICATE_JACCARD = 0.8     # Shingle overlap above which a lower-ranked chunk is dropped
+    SHINGLE_SIZE = 5            # Words per shingle for near-duplicate detection
+    
+    def __init__(self, api_key: Optional[str] = None, gemini_key: Optional[str] = None,
+                 cache_path: Optional[str] = None):
         self.openai_key = api_key or os.getenv("OPENAI_API_KEY")
         self.gemini_key = gemini_key or os.getenv("GEMINI_API_KEY")
         self.use_openai = False
@@ -175,12 +792,18 @@ class LLMInterface:
         self.client = None
         self.model = None
         
+        # Exact-prompt response cache (opened on first API call; shared across threads)
+        self.cache_path = cache_path
+        self._cache = None
+        self._cache_lock = threading.Lock()
+        
         # Try Gemini first if key is provided
         if self.gemini_key:
             try:
                 from google import genai
                 from google.genai import types
                 self.client = genai.Client(api_key=self.gemini_key)
+                self.model = "gemini-2.0-flash-exp"
                 self.use_gemini = True
                 print("✓ Using Gemini AI for answer generation")
                 return
@@ -207,14 +830,27 @@ class LLMInterface:
         print("💡 For better answers, set GEMINI_API_KEY or OPENAI_API_KEY environment variable")
     
     def generate_answer(self, query: str, context_chunks: List[Tuple[Chunk, float]], 
-                       chat_history: List[Dict]) -> str:
-        """Generate answer from context chunks"""
+                       chat_history: List[Dict],
+                       on_delta: Optional[Callable[[str], None]] = None) -> Tuple[str, bool]:
+        """Generate answer from context chunks.
+        
+        Returns (answer, from_api): from_api is True only for a successful
+        LLM response (fresh or from the response cache), not for refusals or
+        fallback snippets.
+        
+        If on_delta is given, LLM output is streamed and on_delta is called
+        with each text fragment as it arrives; the full answer is still returned.
+        """
         
-        # Build context with citations
+        # Nothing relevant retrieved: refuse without paying for an API call
+        if not context_chunks or max(score for _, score in context_chunks) < RELEVANCE_THRESHOLD:
+            return "Not found in the document.", False
+        
+        # Build context with citations (near-duplicates dropped, chunks capped in length)
         context_parts = []
-        for i, (chunk, score) in enumerate(context_chunks, 1):
-            citation = chunk.get_citation()
-            context_parts.append(f"{citation} {chunk.text}")
+        for chunk in self._dedupe_chunks(context_chunks):
+            chunk_text = ' '.join(chunk.text.split()[:self.MAX_CONTEXT_WORDS])
+            context_parts.append(f"{chunk.citation} {chunk_text}")
         
         context = "\n\n".join(context_parts)
         
@@ -252,18 +888,32 @@ Provide a short answer with citations [p{{page}}:c{{chunk}}]. If not found in co
 
 {user_prompt}"""
                 
-                response = self.client.models.generate_content(
-                    model='gemini-2.0-flash-exp',
-                    contents=full_prompt
-                )
-                return response.text.strip()
+                cache_key = self._cache_key(self.model, full_prompt)
+                cached = self._cache_get(cache_key)
+                if cached is not None:
+                    return cached, True
+                
+                if on_delta is None:
+                    response = self.client.models.generate_content(
+                        model=self.model,
+                        contents=full_prompt
+                    )
+                    answer = response.text.strip()
+                else:
+                    stream = self.client.models.generate_content_stream(
+                        model=self.model,
+                        contents=full_prompt
+                    )
+                    answer = self._collect_stream((part.text for part in stream), on_delta)
+                self._cache_put(cache_key, answer)
+                return answer, True
             except Exception as e:
                 error_msg = str(e)
                 if "429" in error_msg or "RESOURCE_EXHAUSTED" in error_msg or "quota" in error_msg.lower():
                     print(f"\n⚠️  Gemini API quota exceeded. Using fallback mode.\n")
                 else:
                     print(f"Error calling Gemini API: {e}")
-                return self._fallback_answer(context_chunks)
+                return self._fallback_answer(context_chunks), False
         
         elif self.use_openai:
             try:
@@ -277,54 +927,182 @@ Provide a short answer with citations [p{{page}}:c{{chunk}}]. If not found in co
                 # Add current query
                 messages.append({"role": "user", "content": user_prompt})
                 
+                cache_key = self._cache_key(self.model, messages)
+                cached = self._cache_get(cache_key)
+                if cached is not None:
+                    return cached, True
+                
                 response = self.client.chat.completions.create(
                     model=self.model,
                     messages=messages,
                     temperature=0.1,
-                    max_tokens=500
+                    max_tokens=500,
+                    stream=on_delta is not None
                 )
-                return response.choices[0].message.content.strip()
+                if on_delta is None:
+                    answer = response.choices[0].message.content.strip()
+                else:
+                    answer = self._collect_stream(
+                        (chunk.choices[0].delta.content for chunk in response if chunk.choices), on_delta)
+                self._cache_put(cache_key, answer)
+                return answer, True
             except Exception as e:
                 print(f"Error calling OpenAI API: {e}")
-                return self._fallback_answer(context_chunks)
+                return self._fallback_answer(context_chunks), False
         else:
-            return self._fallback_answer(context_chunks)
+            return self._fallback_answer(context_chunks), False
+    
+    @classmethod
+    def _dedupe_chunks(cls, context_chunks: List[Tuple[Chunk, float]]) -> List[Chunk]:
+        """Drop chunks that nearly duplicate a higher-ranked chunk (word-shingle Jaccard)"""
+        kept: List[Chunk] = []
+        kept_shingles: List[set] = []
+        for chunk, _score in context_chunks:
+            words = chunk.text.split()
+            shingles = {hash(tuple(words[i:i + cls.SHINGLE_SIZE]))
+                        for i in range(max(len(words) - cls.SHINGLE_SIZE + 1, 1))}
+            if any(len(shingles & other) / len(shingles | other) >= cls.DUPLICATE_JACCARD
+                   for other in kept_shingles):
+                continue
+            kept.append(chunk)
+            kept_shingles.append(shingles)
+        return kept
+    
+    @staticmethod
+    def _collect_stream(deltas: Iterable[Optional[str]], on_delta: Callable[[str], None]) -> str:
+        """Forward streamed text fragments to on_delta and return the joined answer"""
+        parts = []
+        for delta in deltas:
+            if delta:
+                on_delta(delta)
+                parts.append(delta)
+        return ''.join(parts).strip()
+    
+    @staticmethod
+    def _cache_key(model: str, prompt) -> str:
+        """Hash the model name and the exact prompt/messages sent to it"""
+        payload = json.dumps([model, prompt], ensure_ascii=False, sort_keys=True)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=20).hexdigest()
+    
+    def _cache_get(self, key: str) -> Optional[str]:
+        """Return a cached response, or None on miss / disabled cache"""
+        if not self.cache_path:
+            return None
+        try:
+            with self._cache_lock:
+                if self._cache is None:
+                    self._cache = sqlite3.connect(self.cache_path, check_same_thread=False)
+                    self._cache.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, answer TEXT)')
+                row = self._cache.execute('SELECT answer FROM responses WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Warning: LLM cache unavailable: {e}")
+            self.cache_path = None
+            return None
+        return row[0] if row else None
+    
+    def _cache_put(self, key: str, answer: str):
+        """Store a successful API response"""
+        if self._cache is None:
+            return
+        try:
+            with self._cache_lock, self._cache:
+                self._cache.execute('INSERT OR REPLACE INTO responses VALUES (?, ?)', (key, answer))
+        except sqlite3.Error as e:
+            print(f"Warning: Could not write LLM cache: {e}")
     
     def _fallback_answer(self, context_chunks: List[Tuple[Chunk, float]]) -> str:
         """Simple fallback when LLM is not available"""
         if not context_chunks:
             return "Not found in the document."
         
-        # Check if top result is relevant (threshold: 0.4 for better precision)
-        top_chunk, score = context_chunks[0]
-        if score < 0.4:
+        # Check if the best-scoring result is relevant (same test as generate_answer)
+        top_chunk, score = max(context_chunks, key=lambda r: r[1])
+        if score < RELEVANCE_THRESHOLD:
             return "Not found in the document."
         
         # Return top chunk with citation
-        citation = top_chunk.get_citation()
         snippet = top_chunk.text[:200] + "..." if len(top_chunk.text) > 200 else top_chunk.text
-        return f"{citation} {snippet}"
+        return f"{top_chunk.citation} {snippet}"
 
 
 class RAGSystem:
     """Main RAG system orchestrator"""
     
+    CACHE_VERSION = 6         # Bump when the cached index/chunk format changes
+    QA_CACHE_THRESHOLD = 0.95  # Cosine above which a past question's answer is reused
+    ELBOW_DELTA = 0.05         # Min score drop that marks the end of the relevant chunks
+    
     def __init__(self, pdf_path: str, chunk_size: int = 500, chunk_overlap: int = 100,
-                 top_k: int = 5, gemini_key: Optional[str] = None, openai_key: Optional[str] = None):
+                 top_k: int = 5, gemini_key: Optional[str] = None, openai_key: Optional[str] = None,
+                 cache_dir: Optional[str] = ".rag_cache"):
         self.pdf_path = pdf_path
         self.top_k = top_k
         
-        # Initialize components
+        # Initialize components (all on-disk caches live under cache_dir)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
         self.pdf_processor = PDFProcessor(chunk_size, chunk_overlap)
-        self.vector_store = VectorStore()
-        self.llm = LLMInterface(api_key=openai_key, gemini_key=gemini_key)
+        self.vector_store = VectorStore(
+            query_cache_path=os.path.join(cache_dir, "queries.npz") if cache_dir else None)
+        self.llm = LLMInterface(api_key=openai_key, gemini_key=gemini_key,
+                                cache_path=os.path.join(cache_dir, "llm.db") if cache_dir else None)
         
         # Chat history
         self.chat_history = []
         
-        # Process PDF
+        # Semantic answer cache: embeddings of past questions -> answers
+        self._qa_index = None
+        self._qa_answers: List[str] = []
+        self._qa_loaded = 0  # Answers that came from disk (only later ones are written back)
+        self._qa_cache_path = None
+        
         print(f"\n📄 Loading PDF: {pdf_path}")
-        self.chunks = self.pdf_processor.process_pdf(pdf_path)
+        # Read once: the same bytes feed both the cache key and the parser
+        with open(pdf_path, 'rb') as f:
+            pdf_data = f.read()
+        
+        if not cache_dir:
+            self._build(pdf_data)
+        else:
+            # Reuse a previously built index for identical PDF content + settings
+            cache_path = os.path.join(cache_dir, self._cache_key(pdf_data))
+            self._load_or_build(pdf_data, cache_path)
+            # Answers depend on the model; fallback answers are never cached
+            if self.llm.model:
+                self._qa_cache_path = f"{cache_path}.qa-{self.llm.model}"
+        
+        self._load_qa_cache()
+        if self._qa_cache_path:
+            weakref.finalize(self, self._write_qa_cache, self._qa_cache_path,
+                             self._qa_index, self._qa_answers, self._qa_loaded)
+    
+    def _load_or_build(self, pdf_data: bytes, cache_path: str):
+        """Load the cached index at cache_path, or build and save it"""
+        with _file_lock(cache_path):
+            if self.vector_store.load(cache_path):
+                self.chunks = self.vector_store.chunks
+                print(f"✓ Loaded cached index with {len(self.chunks)} chunks\n")
+                return
+            
+            self._build(pdf_data)
+            try:
+                self.vector_store.save(cache_path)
+            except OSError as e:
+                print(f"Warning: Could not write index cache: {e}")
+    
+    def _cache_key(self, pdf_data: bytes) -> str:
+        """Hash PDF bytes together with everything that affects the index"""
+        hasher = hashlib.blake2b(pdf_data, digest_size=16)
+        extractor = "pdfium" if pdfium is not None else "pypdf"
+        settings = (self.pdf_processor.chunk_size, self.pdf_processor.chunk_overlap, extractor,
+                    self.vector_store.embedder_id, self.CACHE_VERSION)
+        hasher.update(repr(settings).encode())
+        return hasher.hexdigest()
+    
+    def _build(self, pdf_data: bytes):
+        """Parse, chunk and embed the PDF"""
+        # Process PDF
+        self.chunks = self.pdf_processor.process_pdf(pdf_data)
         print(f"✓ Extracted {len(self.chunks)} chunks from PDF")
         
         # Build index
@@ -332,49 +1110,245 @@ class RAGSystem:
         self.vector_store.build_index(self.chunks)
         print(f"✓ Index ready with {len(self.chunks)} chunks\n")
     
-    def answer_question(self, query: str) -> str:
-        """Answer a question with retrieval debug info"""
+    def answer_question(self, query: str,
+                        on_delta: Optional[Callable[[str], None]] = None) -> str:
+        """Answer a question with retrieval debug info (on_delta streams LLM output)"""
+        enhanced_query = self._enhance_query(query, self._last_question())
+        query_embedding = self.vector_store.encode_query(enhanced_query)
+        return self._answer(query, enhanced_query, query_embedding, on_delta)
+    
+    def answer_questions(self, queries: List[str], max_workers: int = 8) -> List[str]:
+        """Answer several questions, encoding all of them in one forward pass.
+        
+        Retrieval runs in order; LLM calls then overlap on a thread pool (one
+        per distinct question), each seeing the chat history from before the
+        batch. Retrieval debug is printed in question order; answers are
+        returned (and recorded) in question order, and printing them is left
+        to the caller, as with answer_question.
+        """
+        if not queries:
+            return []
+        
+        # Enhancement only depends on the previous question, so it can be resolved upfront
+        enhanced_queries = []
+        last_question = self._last_question()
+        for query in queries:
+            enhanced_queries.append(self._enhance_query(query, last_question))
+            last_question = query
+        
+        embeddings = self.vector_store.encode_queries(enhanced_queries)
+        
+        # Every LLM call sees the pre-batch history, so the QA cache applies only if it's empty
+        history = list(self.chat_history)
+        use_qa_cache = not history
+        
+        retrieved = []
+        for i, enhanced_query in enumerate(enhanced_queries):
+            answer, results, reused = self._retrieve(enhanced_query, embeddings[i:i + 1], use_qa_cache)
+            self._print_retrieval(results, reused)
+            retrieved.append((answer, results, reused))
+        answers: List[Optional[str]] = [answer for answer, _, _ in retrieved]
+        
+        # Repeated questions retrieve the same chunks, so one LLM call serves them all
+        pending: Dict[Tuple[str, str], List[int]] = {}  # question -> positions needing an answer
+        for i, (answer, _, _) in enumerate(retrieved):
+            if answer is None:
+                pending.setdefault((queries[i], enhanced_queries[i]), []).append(i)
+        
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+                generated = executor.map(
+                    lambda positions: self.llm.generate_answer(
+                        queries[positions[0]], retrieved[positions[0]][1], history),
+                    pending.values())
+                for positions, (answer, from_api) in zip(pending.values(), generated):
+                    for i in positions:
+                        answers[i] = answer
+                    if from_api and use_qa_cache:
+                        self._remember_answer(embeddings[positions[0]:positions[0] + 1], answer)
+        
+        for query, answer in zip(queries, answers):
+            self._record(query, answer)
+        return answers
+    
+    def _last_question(self) -> Optional[str]:
+        """Most recent user question in the chat history"""
+        # Only look at last user question (skip assistant responses)
+        recent_user_msgs = [msg for msg in self.chat_history[-4:] if msg['role'] == 'user']
+        return recent_user_msgs[-1]['content'] if recent_user_msgs else None
+    
+    def _enhance_query(self, query: str, last_question: Optional[str]) -> str:
+        """Enhance query with recent context for multi-turn (fallback mode support)"""
+        if last_question and not (self.llm.use_openai or self.llm.use_gemini):
+            # In fallback mode, combine with last question for better retrieval
+            return f"{last_question} {query}"
+        return query
+    
+    def _answer(self, query: str, enhanced_query: str, query_embedding: np.ndarray,
+                on_delta: Optional[Callable[[str], None]] = None) -> str:
+        """Retrieve, generate and record the answer"""
+        # Answers given mid-conversation may lean on history, so only cache fresh questions
+        use_qa_cache = not self.chat_history
+        answer, results, reused = self._retrieve(enhanced_query, query_embedding, use_qa_cache)
+        self._print_retrieval(results, reused)
+        if answer is None:
+            # Generate answer
+            self._print_answer_header()
+            answer, from_api = self.llm.generate_answer(query, results, self.chat_history, on_delta)
+            if from_api and use_qa_cache:
+                self._remember_answer(query_embedding, answer)
+        self._record(query, answer)
+        return answer
+    
+    def _retrieve(self, enhanced_query: str, query_embedding: np.ndarray, use_qa_cache: bool = True
+                  ) -> Tuple[Optional[str], List[Tuple[Chunk, float]], bool]:
+        """Retrieve chunks for a question (prints nothing).
+        
+        Returns (answer, [], reused) when the question is settled without the
+        LLM (reused from the answer cache, or refused), else (None, results,
+        False) for generation.
+        """
+        # Reuse the answer to a near-identical earlier question
+        cached_answer = self._lookup_answer(query_embedding) if use_qa_cache else None
+        if cached_answer is not None:
+            return cached_answer, [], True
+        
+        # Dense candidates: retrieved once, then reused by search()
+        n_candidates = self.vector_store.candidate_count(self.top_k)
+        indices, scores = self.vector_store.dense_search(query_embedding, n_candidates)
+        
+        # Clearly off-topic (far from every chunk): refuse before lexical retrieval or prompting
+        if len(scores) == 0 or scores[0] < self.vector_store.reject_threshold:
+            return "Not found in the document.", [], False
+        
+        # Retrieve relevant chunks: dense hits only down to their score elbow,
+        # BM25 hits regardless (they sit below the dense hits by construction)
+        dense = list(zip(indices.tolist(), scores.tolist()))
+        dense_keep = self._elbow_k(scores[:self.top_k])
+        results = self.vector_store.search(enhanced_query, self.top_k, query_embedding,
+                                           dense, dense_keep)
         
-        # Enhance query with recent context for multi-turn (fallback mode support)
-        enhanced_query = query
-        if self.chat_history and not (self.llm.use_openai or self.llm.use_gemini):
-            # In fallback mode, enhance the query with last question for context
-            # Only look at last user question (skip assistant responses)
-            recent_user_msgs = [msg for msg in self.chat_history[-4:] if msg['role'] == 'user']
-            if recent_user_msgs:
-                last_question = recent_user_msgs[-1]['content']
-                # Combine for better retrieval
-                enhanced_query = f"{last_question} {query}"
+        if not results:
+            return "Not found in the document.", [], False
         
-        # Retrieve relevant chunks
-        results = self.vector_store.search(enhanced_query, self.top_k)
+        return None, results, False
+    
+    @staticmethod
+    def _print_retrieval(results: List[Tuple[Chunk, float]], reused: bool):
+        """Show retrieval debug info (or note a reused answer)"""
+        if reused:
+            print("\n♻️  Reusing answer to a similar earlier question")
+        if not results:
+            return
         
-        # Show retrieval debug
         print("\n" + "="*80)
         print("🔍 RETRIEVAL DEBUG")
         print("="*80)
         
-        if not results:
-            print("No relevant chunks found.")
-            return "Not found in the document."
-        
         for i, (chunk, score) in enumerate(results, 1):
-            print(f"\n[Rank {i}] {chunk.get_citation()} | Score: {score:.4f}")
+            print(f"\n[Rank {i}] {chunk.citation} | Score: {score:.4f}")
             snippet = chunk.text[:150] + "..." if len(chunk.text) > 150 else chunk.text
             print(f"Text: {snippet}")
-        
+    
+    @staticmethod
+    def _print_answer_header():
+        """Header printed right before an answer is emitted"""
         print("\n" + "="*80)
         print("💡 ANSWER")
         print("="*80)
+    
+    def _elbow_k(self, top_scores: np.ndarray) -> int:
+        """Number of chunks before the largest drop in (descending) scores.
         
-        # Generate answer
-        answer = self.llm.generate_answer(query, results, self.chat_history)
-        
-        # Update chat history
+        With no clear drop the distribution is flat and all top_k are kept.
+        """
+        if len(top_scores) < 2:
+            return len(top_scores)
+        gaps = top_scores[:-1] - top_scores[1:]
+        if gaps.max() <= self.ELBOW_DELTA:
+            return len(top_scores)
+        return int(np.argmax(gaps)) + 1
+    
+    def _record(self, query: str, answer: str):
+        """Update chat history"""
         self.chat_history.append({"role": "user", "content": query})
         self.chat_history.append({"role": "assistant", "content": answer})
-        
-        return answer
+    
+    def _lookup_answer(self, query_embedding: np.ndarray) -> Optional[str]:
+        """Return a past answer whose question is within the semantic threshold"""
+        if self._qa_index.ntotal == 0:
+            return None
+        scores, indices = self._qa_index.search(query_embedding, 1)
+        if scores[0][0] < self.QA_CACHE_THRESHOLD:
+            return None
+        return self._qa_answers[indices[0][0]]
+    
+    def _remember_answer(self, query_embedding: np.ndarray, answer: str):
+        """Add a question embedding and its answer to the semantic cache"""
+        self._qa_index.add(query_embedding)
+        self._qa_answers.append(answer)
+    
+    def _load_qa_cache(self):
+        """Load answers cached for this document, or start an empty cache"""
+        self._qa_index = faiss.IndexFlatIP(self.vector_store.dimension)
+        self._qa_answers = []
+        self._qa_loaded = 0
+        if not self._qa_cache_path:
+            return
+        with _file_lock(self._qa_cache_path):
+            cached = self._read_qa_cache(self._qa_cache_path, self.vector_store.dimension)
+        if cached is not None:
+            self._qa_index, self._qa_answers = cached
+            self._qa_loaded = len(self._qa_answers)
+    
+    def _save_qa_cache(self):
+        """Persist the semantic answer cache next to the document's index cache"""
+        if self._qa_cache_path:
+            self._write_qa_cache(self._qa_cache_path, self._qa_index, self._qa_answers, self._qa_loaded)
+    
+    @staticmethod
+    def _read_qa_cache(path: str, dimension: int) -> Optional[Tuple[object, List[str]]]:
+        """(index, answers) saved at path, or None if missing or unusable (caller holds the lock)"""
+        if not (os.path.exists(path + ".faiss") and os.path.exists(path + ".json")):
+            return None
+        try:
+            index = faiss.read_index(path + ".faiss")
+            with open(path + ".json", encoding='utf-8') as f:
+                answers = json.load(f)
+        except Exception as e:
+            print(f"Warning: Ignoring unreadable answer cache {path}: {e}")
+            return None
+        if index.ntotal != len(answers) or index.d != dimension:
+            return None
+        return index, answers
+    
+    @staticmethod
+    def _write_qa_cache(path: str, index, answers: List[str], n_loaded: int):
+        """Merge answers added since loading (answers[n_loaded:]) into the cache at path"""
+        if len(answers) <= n_loaded:
+            return
+        new_vectors = index.reconstruct_n(n_loaded, len(answers) - n_loaded)
+        try:
+            with _file_lock(path):
+                # Other runs may have saved since this one loaded; keep their answers too
+                merged = RAGSystem._read_qa_cache(path, index.d)
+                merged_index, merged_answers = merged or (faiss.IndexFlatIP(index.d), [])
+                for vector, answer in zip(new_vectors, answers[n_loaded:]):
+                    if merged_index.ntotal:
+                        scores, _ = merged_index.search(vector[None, :], 1)
+                        if scores[0][0] >= RAGSystem.QA_CACHE_THRESHOLD:
+                            continue  # Already answered (by another run or an earlier save)
+                    merged_index.add(vector[None, :])
+                    merged_answers.append(answer)
+                
+                # Write both files aside, then swap them in, so a crash never leaves a torn pair
+                faiss.write_index(merged_index, path + ".faiss.tmp")
+                with open(path + ".json.tmp", 'w', encoding='utf-8') as f:
+                    json.dump(merged_answers, f, ensure_ascii=False)
+                os.replace(path + ".faiss.tmp", path + ".faiss")
+                os.replace(path + ".json.tmp", path + ".json")
+        except OSError as e:
+            print(f"Warning: Could not save answer cache: {e}")
     
     def chat_loop(self):
         """Interactive chat loop"""
@@ -401,8 +1375,21 @@ class RAGSystem:
                     print("✓ Conversation history cleared.\n")
                     continue
                 
-                answer = self.answer_question(query)
-                print(f"\n{answer}\n")
+                # Print LLM output as it streams in
+                streamed = []
+                
+                def print_delta(text: str):
+                    if not streamed:
+                        print()
+                    streamed.append(text)
+                    print(text, end='', flush=True)
+                
+                answer = self.answer_question(query, on_delta=print_delta)
+                if streamed:
+                    print("\n")
+                # Cached, fallback or refusal answers arrive without streaming
+                if ''.join(streamed).strip() != answer:
+                    print(f"\n{answer}\n")
                 
             except KeyboardInterrupt:
                 print("\n\n👋 Goodbye!")
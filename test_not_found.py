@@ -2,9 +2,13 @@
 Test script to verify "Not found in the document." behavior
 """
 import os
+import re
 import sys
 from main import RAGSystem
 
+NOT_FOUND_RE = re.compile(r"not found in the document", re.IGNORECASE)
+CITATION_RE = re.compile(r"\[p\d+.*?:c\d+")
+
 # Set environment for offline mode
 os.environ['HF_HUB_OFFLINE'] = '1'
 
@@ -38,17 +42,22 @@ def test_not_found_behavior():
         "Tell me about airports",
     ]
     
+    # Encode every question in a single forward pass, then answer in order
+    answers = rag.answer_questions(off_topic_questions + valid_questions)
+    off_topic_answers = answers[:len(off_topic_questions)]
+    valid_answers = answers[len(off_topic_questions):]
+    
     print("\n" + "=" * 80)
     print("OFF-TOPIC QUESTIONS (should return 'Not found')")
     print("=" * 80)
     
-    for q in off_topic_questions:
+    for q, answer in zip(off_topic_questions, off_topic_answers):
+        snippet = answer[:150]
         print(f"\nQ: {q}")
-        answer = rag.answer_question(q)
-        print(f"A: {answer[:150]}...")
+        print(f"A: {snippet}...")
         
         # Check if "Not found" is in the answer
-        if "not found in the document" in answer.lower():
+        if NOT_FOUND_RE.search(answer):
             print("✅ PASS - Correctly refused")
         else:
             print("❌ FAIL - Should have said 'Not found'")
@@ -57,15 +66,15 @@ def test_not_found_behavior():
     print("VALID QUESTIONS (should return answers with citations)")
     print("=" * 80)
     
-    for q in valid_questions:
+    for q, answer in zip(valid_questions, valid_answers):
+        snippet = answer[:200]
         print(f"\nQ: {q}")
-        answer = rag.answer_question(q)
-        print(f"A: {answer[:200]}...")
+        print(f"A: {snippet}...")
         
         # Check if citation exists or got real answer
-        if "not found in the document" in answer.lower():
+        if NOT_FOUND_RE.search(answer):
             print("⚠️  WARNING - Might have missed valid content")
-        elif "[p" in answer and ":c" in answer:
+        elif CITATION_RE.search(answer):
             print("✅ PASS - Has citations")
         else:
             print("✅ INFO - Answered (fallback mode)")